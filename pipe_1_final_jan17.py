@@ -5,27 +5,58 @@ Pipeline 1 focuses on using the StaffSpy library to scrape profiles by searching
 based on role, company, location.
 
 After scraping relevant profiles, send anywhere between 20-25 connection 
-requests (random number recommended) after implementing random delays to prevent 
-rate limiting by LinkedIn.
+requests (random number recommended). Company scrapes run concurrently with no 
+delay between them; connection requests are spaced a random 60-180 seconds apart 
+to prevent rate limiting by LinkedIn.
 
 """
 
-# After this pipeline executes, results saved in csv.
+# After this pipeline executes, results saved in parquet.
 
 
+import asyncio
+import functools
 import random
 import logging
 import os
 import json
 import time
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from datetime import datetime
 from dotenv import load_dotenv
 import requests
+from concurrent.futures import ThreadPoolExecutor
 
 # LinkedIn imports
 from staffspy import LinkedInAccount, DriverType, BrowserType
 from linkedin_api import Linkedin
+from pybloom_live import BloomFilter
+from diskcache import Cache
+
+# Load credentials from .env once at startup
+load_dotenv()
+LINKEDIN_USERNAME = os.getenv("LINKEDIN_USERNAME")
+LINKEDIN_PASSWORD = os.getenv("LINKEDIN_PASSWORD")
+
+# Maximum number of blocking LinkedIn calls in flight (and worker threads running them)
+LINKEDIN_MAX_WORKERS = int(os.getenv("LINKEDIN_MAX_WORKERS", "3"))
+
+# Connection requests go out one at a time, a random 60-180 seconds apart
+CONNECTION_INTERVAL_RANGE = (60, 180)  # seconds
+
+# Bloom filter of profile IDs we've already tried to connect with
+ATTEMPTED_FILTER_FILE = 'output/attempted.bloom'
+ATTEMPTED_FILTER_CAPACITY = 1_000_000
+ATTEMPTED_FILTER_ERROR_RATE = 0.001
+
+# Connection attempts log written by earlier versions of this pipeline
+LEGACY_ATTEMPTS_FILE = 'output/previous_connection_attempts.csv'
+
+# On-disk cache of get_profile responses, shared by retries and reruns
+PROFILE_CACHE_DIR = 'output/profile_cache'
+PROFILE_CACHE_TTL = 3600  # seconds
 
 # Configure logging
 log_dir = 'logs'
@@ -63,15 +94,10 @@ def initialize_linkedin_session():
     logger.info("Initializing LinkedIn session")
     
     try:
-        # Load credentials from .env
-        load_dotenv()
-        username = os.getenv("LINKEDIN_USERNAME")
-        password = os.getenv("LINKEDIN_PASSWORD")
-        
-        if not username or not password:
+        if not LINKEDIN_USERNAME or not LINKEDIN_PASSWORD:
             raise ValueError("LinkedIn credentials not found in environment variables")
         
-        logger.info(f"Using username: {username}")
+        logger.info(f"Using username: {LINKEDIN_USERNAME}")
         
         # Initialize LinkedIn Account with minimal configuration
         try:
@@ -105,12 +131,7 @@ def initialize_linkedin_api_session(account):
     """Initialize LinkedIn API session using StaffSpy session cookies"""
     logger.info("Initializing LinkedIn API session")
     
-    # Load credentials from .env
-    load_dotenv()
-    username = os.getenv("LINKEDIN_USERNAME")
-    password = os.getenv("LINKEDIN_PASSWORD")
-    
-    if not username or not password:
+    if not LINKEDIN_USERNAME or not LINKEDIN_PASSWORD:
         raise ValueError("LinkedIn credentials not found in environment variables")
     
     # Use the RequestsCookieJar directly from StaffSpy session
@@ -119,35 +140,36 @@ def initialize_linkedin_api_session(account):
     # Initialize LinkedIn API with saved cookies
     try:
         logger.info("Initializing LinkedIn API client with saved cookies")
-        li = Linkedin(username=username, password=password, cookies=cookies, refresh_cookies=True, debug=True)
+        li = Linkedin(username=LINKEDIN_USERNAME, password=LINKEDIN_PASSWORD, cookies=cookies, refresh_cookies=True, debug=True)
         logger.info("LinkedIn API client initialized successfully")
         return li
     except Exception as e:
         logger.error(f"Failed to initialize LinkedIn API client: {str(e)}")
         raise
 
-def send_connection_request(api_client, profile_id, max_retries=3, retry_delay=5):
-    """Send a connection request with retry logic"""
+@functools.lru_cache(maxsize=None)
+def get_profile_cache():
+    """Open the profile cache on first use, so importing this module creates nothing on disk"""
+    return Cache(PROFILE_CACHE_DIR)
+
+def get_profile_cached(api_client, profile_id):
+    """Fetch profile data, reusing a cached response younger than PROFILE_CACHE_TTL"""
+    profile_cache = get_profile_cache()
+    profile_data = profile_cache.get(profile_id)
+    if profile_data is None:
+        profile_data = api_client.get_profile(public_id=profile_id)
+        if profile_data:
+            profile_cache.set(profile_id, profile_data, expire=PROFILE_CACHE_TTL)
+    return profile_data
+
+def send_connection_request(api_client, profile_id, max_retries=2, retry_delay=5):
+    """Send a connection request, retrying once on network errors"""
     for attempt in range(max_retries):
         try:
             # Add a small delay between retries
             if attempt > 0:
                 time.sleep(retry_delay)
             
-            # First, verify the profile exists and is accessible
-            try:
-                profile_data = api_client.get_profile(public_id=profile_id)
-                if not profile_data:
-                    return False, "Profile not found or not accessible"
-                
-                logger.debug(f"Found profile data: {profile_data.get('public_id')}")
-                
-            except Exception as profile_err:
-                logger.warning(f"Error fetching profile data: {str(profile_err)}")
-                if attempt == max_retries - 1:
-                    return False, f"Could not fetch profile data: {str(profile_err)}"
-                continue
-            
             # Send the connection request
             response = api_client.add_connection(
                 profile_public_id=profile_id
@@ -156,19 +178,63 @@ def send_connection_request(api_client, profile_id, max_retries=3, retry_delay=5
             # The API returns True if request failed, False if successful
             if response is False:
                 return True, "Connection request sent successfully"
-            else:
-                return False, "Failed to send connection request"
+            
+            # Only look the profile up when debugging why a request failed
+            if logger.isEnabledFor(logging.DEBUG):
+                try:
+                    profile_data = get_profile_cached(api_client, profile_id)
+                    logger.debug(f"Profile data for failed request: {profile_data.get('public_id') if profile_data else None}")
+                except Exception as profile_err:
+                    logger.debug(f"Error fetching profile data: {str(profile_err)}")
+            
+            return False, "Failed to send connection request"
                 
-        except Exception as e:
+        except requests.exceptions.RequestException as e:
             if attempt == max_retries - 1:
                 return False, str(e)
             logger.warning(f"Error on attempt {attempt + 1}: {str(e)}, retrying...")
             continue
+        except Exception as e:
+            return False, str(e)
     
     return False, f"Failed after {max_retries} attempts"
 
-def scrape_and_connect(account, api_client):
-    """Main function to scrape profiles and send connection requests"""
+def load_attempted_filter(attempts_dataset_dir):
+    """Load the Bloom filter of attempted profile IDs, rebuilding it from past attempts if missing or unreadable"""
+    if os.path.exists(ATTEMPTED_FILTER_FILE):
+        try:
+            with open(ATTEMPTED_FILTER_FILE, 'rb') as f:
+                return BloomFilter.fromfile(f)
+        except Exception as e:
+            logger.warning(f"Could not read {ATTEMPTED_FILTER_FILE}, rebuilding it from past attempts: {str(e)}")
+    
+    return build_attempted_filter(attempts_dataset_dir)
+
+def build_attempted_filter(attempts_dataset_dir):
+    """Build the Bloom filter of attempted profile IDs from the attempts dataset and legacy CSV"""
+    attempted_filter = BloomFilter(capacity=ATTEMPTED_FILTER_CAPACITY, error_rate=ATTEMPTED_FILTER_ERROR_RATE)
+    if os.path.exists(attempts_dataset_dir):
+        # Only the profile_id column is read from the partitioned dataset
+        for profile_id in pd.read_parquet(attempts_dataset_dir, columns=['profile_id'])['profile_id']:
+            attempted_filter.add(profile_id)
+    if os.path.exists(LEGACY_ATTEMPTS_FILE):
+        # Also include attempts recorded before the switch to the Parquet dataset
+        for profile_id in pd.read_csv(LEGACY_ATTEMPTS_FILE, usecols=['profile_id'], dtype=str)['profile_id'].dropna():
+            attempted_filter.add(profile_id)
+    return attempted_filter
+
+def save_attempted_filter(attempted_filter):
+    """Persist the Bloom filter of attempted profile IDs"""
+    os.makedirs(os.path.dirname(ATTEMPTED_FILTER_FILE), exist_ok=True)
+    # Write to a temp file and swap it in, so a crash mid-write can't leave a truncated filter
+    tmp_file = ATTEMPTED_FILTER_FILE + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        attempted_filter.tofile(f)
+    os.replace(tmp_file, ATTEMPTED_FILTER_FILE)
+    logger.info(f"Saved attempted profiles filter to {ATTEMPTED_FILTER_FILE}")
+
+async def scrape_and_connect_async(account, api_client):
+    """Scrape profiles and send connection requests, overlapping company scrapes"""
     logger.info("----------------------------Starting LinkedIn lead generation pipeline----------------------------")
     
     # List of companies to scrape from
@@ -197,37 +263,64 @@ def scrape_and_connect(account, api_client):
     
     logger.info(f"Scraping profiles for {len(selected_companies)} companies")
     
-    # Collect all scraped profiles
-    all_scraped_profiles = []
+    # Collect all scraped profiles as columnar Arrow tables, one per company
+    scraped_tables = []
     connection_attempts = []
     successful_connections = 0
     target_connections = 15  # Increased target number of successful connection requests
     max_attempts_per_company = 2  # Maximum number of attempts per company
     
-    # Try to load previous connection attempts to avoid duplicates
+    # Load the filter of previously attempted profiles to avoid duplicates
+    attempts_dataset_dir = "output/connection_attempts"
+    # Only persist the filter if it reflects the full history; an empty fallback
+    # must not replace the saved one, or the history would never be reseeded
+    save_filter = True
     try:
-        previous_attempts_file = "output/previous_connection_attempts.csv"
-        if os.path.exists(previous_attempts_file):
-            previous_attempts = pd.read_csv(previous_attempts_file)
-            previous_profile_ids = set(previous_attempts['profile_id'].tolist())
-            logger.info(f"Loaded {len(previous_profile_ids)} previous connection attempts")
-        else:
-            previous_profile_ids = set()
+        attempted_filter = load_attempted_filter(attempts_dataset_dir)
+        logger.info(f"Loaded filter of ~{len(attempted_filter)} previous connection attempts")
     except Exception as e:
         logger.warning(f"Could not load previous connection attempts: {str(e)}")
-        previous_profile_ids = set()
+        attempted_filter = BloomFilter(capacity=ATTEMPTED_FILTER_CAPACITY, error_rate=ATTEMPTED_FILTER_ERROR_RATE)
+        save_filter = False
+    
+    loop = asyncio.get_running_loop()
+    # Cap the number of LinkedIn calls in flight at any one time
+    semaphore = asyncio.Semaphore(LINKEDIN_MAX_WORKERS)
+    # Pace connection requests; coroutines wait here for their turn
+    connection_lock = asyncio.Lock()
+    next_connection_at = loop.time()
+    
+    async def run_blocking(func, *args, **kwargs):
+        """Run a blocking LinkedIn call in the thread pool, bounded by the semaphore"""
+        async with semaphore:
+            return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
     
-    # Scrape profiles from each company
-    for company in selected_companies:
+    async def send_paced_connection_request(profile_id):
+        """Send a connection request once its slot opens, timing the next slot from when it returns"""
+        nonlocal next_connection_at
+        # Hold the lock across the send, so a request queued behind scrapes on the
+        # semaphore can't let the following ones go out back to back
+        async with connection_lock:
+            await asyncio.sleep(max(0, next_connection_at - loop.time()))
+            logger.info(f"Attempting to connect with profile ID: {profile_id}")
+            result = await run_blocking(send_connection_request, api_client, profile_id)
+            next_connection_at = loop.time() + random.uniform(*CONNECTION_INTERVAL_RANGE)
+        return result
+    
+    async def process_company(company):
+        """Scrape one company and try to connect with a few of its profiles"""
+        nonlocal successful_connections
+        
         if successful_connections >= target_connections:
             logger.info(f"Reached target of {target_connections} successful connections")
-            break
+            return
             
         try:
             logger.debug(f"Scraping profiles for company: {company}")
             
             # Use staffspy's scrape_staff method with connect=False
-            staff_df = account.scrape_staff(
+            staff_df = await run_blocking(
+                account.scrape_staff,
                 company_name=company,
                 search_term="software engineer",
                 location="india",
@@ -240,51 +333,50 @@ def scrape_and_connect(account, api_client):
                 # Print column names for debugging
                 logger.info(f"Columns in DataFrame: {list(staff_df.columns)}")
                 
-                # Save results to CSV
-                output_dir = 'output'
-                os.makedirs(output_dir, exist_ok=True)
-                output_file = f"{output_dir}/{company}_staff_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-                staff_df.to_csv(output_file, index=False)
-                logger.info(f"Saved {len(staff_df)} profiles to {output_file}")
+                logger.info(f"Scraped {len(staff_df)} profiles for {company}")
                 
-                # Randomly shuffle profiles
-                profiles_to_try = staff_df.sample(frac=1).to_dict('records')
+                # Randomly sample only as many profiles as we might try
+                profiles_to_try = staff_df.sample(n=min(max_attempts_per_company * 3, len(staff_df))).to_dict('records')
                 
-                # Try each profile until we get enough successful connections
-                attempts_for_company = 0
+                # Pick the profiles to try for this company, skipping duplicates
+                batch_size = min(max_attempts_per_company, target_connections - successful_connections)
+                batch = []
                 for profile_to_connect in profiles_to_try:
-                    if successful_connections >= target_connections:
-                        break
-                        
-                    if attempts_for_company >= max_attempts_per_company:
+                    if len(batch) >= batch_size:
                         logger.info(f"Reached maximum attempts for company {company}")
                         break
                         
-                    try:
-                        # Get profile ID and name from the correct fields
-                        profile_id = profile_to_connect.get('profile_id') or profile_to_connect.get('profile_link', '').split('/')[-1]
-                        full_name = profile_to_connect.get('name', 'Unknown')
-                        company = profile_to_connect.get('current_company', 'Unknown Company')
+                    # Get profile ID and name from the correct fields
+                    profile_id = profile_to_connect.get('profile_id') or profile_to_connect.get('profile_link', '').split('/')[-1]
+                    full_name = profile_to_connect.get('name', 'Unknown')
+                    profile_company = profile_to_connect.get('current_company', 'Unknown Company')
+                    
+                    if not profile_id or profile_id == 'Unknown':
+                        logger.warning(f"Skipping profile with no ID: {full_name}")
+                        continue
                         
-                        if not profile_id or profile_id == 'Unknown':
-                            logger.warning(f"Skipping profile with no ID: {full_name}")
-                            continue
-                            
-                        if profile_id in previous_profile_ids:
-                            logger.info(f"Skipping {full_name} - already attempted connection")
-                            continue
-                            
-                        logger.info(f"Attempting to connect with profile ID: {profile_id}")
-                        attempts_for_company += 1
+                    if profile_id in attempted_filter:
+                        logger.info(f"Skipping {full_name} - already attempted connection")
+                        continue
                         
-                        # Send connection request
-                        success, message = send_connection_request(api_client, profile_id)
+                    # Mark as attempted now so concurrent companies don't pick it up too
+                    attempted_filter.add(profile_id)
+                    batch.append((profile_id, (full_name, profile_company)))
+                
+                async def connect(profile_id, meta):
+                    result = await send_paced_connection_request(profile_id)
+                    return profile_id, meta, result
+                
+                # Send the batch concurrently and record attempts as they complete
+                for future in asyncio.as_completed([connect(profile_id, meta) for profile_id, meta in batch]):
+                    try:
+                        profile_id, (full_name, profile_company), (success, message) = await future
                         
                         # Record the attempt
                         connection_attempts.append({
                             'profile_id': profile_id,
                             'full_name': full_name,
-                            'company': company,
+                            'company': profile_company,
                             'timestamp': datetime.now().isoformat(),
                             'success': success,
                             'message': message
@@ -292,59 +384,61 @@ def scrape_and_connect(account, api_client):
                         
                         if success:
                             successful_connections += 1
-                            logger.info(f"Successfully sent connection request to {full_name} from {company}")
+                            logger.info(f"Successfully sent connection request to {full_name} from {profile_company}")
                         else:
-                            logger.warning(f"Failed to send connection request to {full_name} from {company}: {message}")
-                            # Continue with next profile even if this one failed
-                            continue
-                            
-                        # Add a random delay between requests to avoid rate limiting
-                        delay = random.uniform(45, 90)  # Increased delay between requests
-                        logger.debug(f"Waiting {delay} seconds before next request")
-                        time.sleep(delay)
+                            logger.warning(f"Failed to send connection request to {full_name} from {profile_company}: {message}")
                         
                     except Exception as e:
                         logger.error(f"Error processing profile: {str(e)}")
                         continue
                 
                 # Add to total scraped profiles
-                all_scraped_profiles.extend(staff_df.to_dict('records'))
-                
-                # Random delay between companies
-                delay = random.randint(60, 180)
-                logger.debug(f"Waiting {delay} seconds before next company")
-                time.sleep(delay)
+                scraped_tables.append(pa.Table.from_pandas(staff_df.assign(source_company=company), preserve_index=False))
             
         except Exception as e:
             logger.error(f"Error scraping profiles for {company}: {str(e)}")
-            continue
     
-    # Save the full list of scraped profiles
-    if all_scraped_profiles:
-        full_output_file = f"output/all_scraped_profiles_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        pd.DataFrame(all_scraped_profiles).to_csv(full_output_file, index=False)
-        logger.info(f"Saved total of {len(all_scraped_profiles)} profiles to {full_output_file}")
+    # Scrape all companies concurrently; blocking calls run in the thread pool
+    with ThreadPoolExecutor(max_workers=LINKEDIN_MAX_WORKERS) as executor:
+        await asyncio.gather(*(process_company(company) for company in selected_companies))
     
-    # Save connection attempts log
+    # Save connection attempts log first, so requests already sent are recorded
+    # even if writing the scraped profiles fails
     if connection_attempts:
-        # Save to timestamped file
-        connection_log_file = f"output/connection_attempts_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        pd.DataFrame(connection_attempts).to_csv(connection_log_file, index=False)
-        logger.info(f"Saved {len(connection_attempts)} connection attempts to {connection_log_file}")
+        # Append this run's attempts to the attempts dataset, partitioned by date
+        try:
+            attempts_df = pd.DataFrame(connection_attempts)
+            attempts_df['date'] = datetime.now().strftime('%Y-%m-%d')
+            attempts_df.to_parquet(attempts_dataset_dir, partition_cols=['date'], engine='pyarrow', compression='zstd', index=False)
+            logger.info(f"Saved {len(connection_attempts)} connection attempts to {attempts_dataset_dir}")
+        except Exception as e:
+            logger.error(f"Error saving connection attempts: {str(e)}")
         
-        # Update the master list of previous attempts
+        if save_filter:
+            try:
+                save_attempted_filter(attempted_filter)
+            except Exception as e:
+                logger.error(f"Error saving attempted profiles filter: {str(e)}")
+    
+    # Save the full list of scraped profiles
+    if scraped_tables:
         try:
-            all_attempts = []
-            if os.path.exists(previous_attempts_file):
-                all_attempts.extend(pd.read_csv(previous_attempts_file).to_dict('records'))
-            all_attempts.extend(connection_attempts)
-            pd.DataFrame(all_attempts).to_csv(previous_attempts_file, index=False)
-            logger.info(f"Updated master list of connection attempts in {previous_attempts_file}")
+            os.makedirs('output', exist_ok=True)
+            # Company frames can infer different column types (e.g. int64 vs double
+            # when a value is missing), so let Arrow widen them to a common type
+            all_scraped_profiles = pa.concat_tables(scraped_tables, promote_options='permissive')
+            full_output_file = f"output/all_scraped_profiles_{datetime.now().strftime('%Y%m%d_%H%M%S')}.parquet"
+            pq.write_table(all_scraped_profiles, full_output_file, compression='zstd')
+            logger.info(f"Saved total of {all_scraped_profiles.num_rows} profiles to {full_output_file}")
         except Exception as e:
-            logger.error(f"Error updating master connection attempts file: {str(e)}")
+            logger.error(f"Error saving scraped profiles: {str(e)}")
     
     logger.info(f"Connection request summary: {successful_connections} successful out of {target_connections} target")
 
+def scrape_and_connect(account, api_client):
+    """Main function to scrape profiles and send connection requests"""
+    asyncio.run(scrape_and_connect_async(account, api_client))
+
 def main():
     """Main entry point"""
     try:
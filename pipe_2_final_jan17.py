@@ -1,7 +1,12 @@
+import asyncio
 import os
 import logging
+from logging.handlers import RotatingFileHandler
 import json
 import requests
+import orjson
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime
 from dotenv import load_dotenv
 from linkedin_api import Linkedin
@@ -9,31 +14,41 @@ from staffspy.linkedin.linkedin import LinkedInScraper
 from staffspy import LinkedInAccount, DriverType, BrowserType
 import time
 import random
+from concurrent.futures import ThreadPoolExecutor
+
+# Load credentials from .env once at startup
+load_dotenv()
+LINKEDIN_USERNAME = os.getenv("LINKEDIN_USERNAME")
+LINKEDIN_PASSWORD = os.getenv("LINKEDIN_PASSWORD")
 
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler(f'logs/linkedin_pipeline_{datetime.now().strftime("%Y%m%d_%H%M%S")}.log'),
+        RotatingFileHandler(f'logs/linkedin_pipeline_{datetime.now().strftime("%Y%m%d_%H%M%S")}.log', maxBytes=10_000_000, backupCount=3),
         logging.StreamHandler()
     ]
 )
 logger = logging.getLogger(__name__)
 
-def get_llm_response(profile_data):
-    """Generate personalized message using local LLM"""
-    try:
-        # Define the prompt template
-        prompt = f'''
+# Number of concurrent requests sent to the local LLM server
+LLM_BATCH_SIZE = 4
+
+# Shared session so LLM calls reuse keep-alive connections to LM Studio
+llm_session = requests.Session()
+llm_session.mount('http://', HTTPAdapter(pool_connections=10, pool_maxsize=10, max_retries=Retry(total=3, backoff_factor=0.5)))
+
+# Prompt for the first outreach message; placeholders are filled per profile
+PROMPT_TEMPLATE = '''
 You're a career coach who's helped 100+ engineers land roles at MAANG companies. Write a compelling first message that creates immediate interest and urgency. The goal is to get their contact details in the first response.
 
 About them:
-• Name: {profile_data['name']}
-• Role: {profile_data['current_position']} at {profile_data['company']}
-• Experience: {profile_data['experiences']}
-• Key skills: {', '.join(profile_data['skills'])}
-• Certifications: {', '.join(profile_data['certifications'])}
+• Name: {name}
+• Role: {current_position} at {company}
+• Experience: {experiences}
+• Key skills: {skills}
+• Certifications: {certifications}
 
 Write a message that:
 1. Opens with a specific observation about their experience trajectory from previous roles to current role so that it shows you've actually looked at their profile.
@@ -52,6 +67,19 @@ Write a message that:
 
 Keep it a concise amount of characters. Make it feel personal yet professional. Focus on transformation - from where they are to where they could be.
 '''
+
+def get_llm_response(profile_data):
+    """Generate personalized message using local LLM"""
+    try:
+        # Fill in the prompt template
+        prompt = PROMPT_TEMPLATE.format_map({
+            'name': profile_data['name'],
+            'current_position': profile_data['current_position'],
+            'company': profile_data['company'],
+            'experiences': profile_data['experiences'],
+            'skills': ', '.join(profile_data['skills']),
+            'certifications': ', '.join(profile_data['certifications'])
+        })
         
         # Prepare the payload
         payload = {
@@ -63,37 +91,56 @@ Keep it a concise amount of characters. Make it feel personal yet professional.
             ],
             "temperature": 0.3,
             "max_tokens": 300,
-            "stream": False
+            "stream": True
         }
         
         try:
-            response = requests.post(
+            with llm_session.post(
                 'http://127.0.0.1:1234/v1/chat/completions',  
                 headers={
                     "Content-Type": "application/json", 
-                    "Accept": "application/json"
+                    "Accept": "text/event-stream"
                 },
-                json=payload
-            )
-            
-            response.raise_for_status()
-            
-            try:
-                response_json = response.json()
+                data=orjson.dumps(payload),
+                stream=True
+            ) as response:
+                if not response.ok:
+                    logger.error(f"LLM API error: {response.status_code} {response.reason}")
+                    logger.error(f"Response: {response.text}")
+                    return None
                 
-                # Log the full response for debugging
-                logger.debug(f"Full LLM response: {response_json}")
-                
-                # Extract message content
-                message = response_json['choices'][0]['message']['content'].strip()
+                line = b''
+                try:
+                    # Accumulate the streamed deltas until the server finishes. Read on to
+                    # [DONE]/EOF even after finish_reason, so the connection can go back
+                    # to llm_session's pool instead of being closed
+                    chunks = []
+                    finished = False
+                    for line in response.iter_lines():
+                        if not line.startswith(b'data: '):
+                            continue
+                        data = line[len(b'data: '):]
+                        if data == b'[DONE]':
+                            break
+                        if finished:
+                            continue
+                        
+                        choice = orjson.loads(data)['choices'][0]
+                        chunks.append(choice.get('delta', {}).get('content') or '')
+                        finished = bool(choice.get('finish_reason'))
+                    
+                    logger.debug(f"Received {len(chunks)} streamed chunks from LLM")
+                    
+                    # Extract message content
+                    message = ''.join(chunks).strip()
+                    
+                    logger.info(f"Generated message: {message}")
+                    return message
                 
-                logger.info(f"Generated message: {message}")
-                return message
-            
-            except Exception as e:
-                logger.error(f"Error processing LLM response: {e}")
-                logger.error(f"Raw response: {response.text[:500]}")
-                return None
+                except Exception as e:
+                    logger.error(f"Error processing LLM response: {e}")
+                    logger.error(f"Raw response line: {line[:500]}")
+                    return None
                 
         except requests.exceptions.ConnectionError:
             logger.error("Could not connect to LM Studio. Ensure it's running on port 1234")
@@ -101,29 +148,26 @@ Keep it a concise amount of characters. Make it feel personal yet professional.
         except requests.exceptions.Timeout:
             logger.error("LM Studio request timed out")
             return None
-        except requests.exceptions.HTTPError as e:
-            logger.error(f"LLM API error: {e}")
-            logger.error(f"Response: {response.text}")
-            return None
             
     except Exception as e:
         logger.error(f"Unexpected error in LLM message generation: {e}")
         return None
 
+def generate_messages(profiles):
+    """Generate messages for several profiles, keeping LLM_BATCH_SIZE requests in flight"""
+    with ThreadPoolExecutor(max_workers=LLM_BATCH_SIZE) as executor:
+        # map() preserves order, so messages line up with the input profiles
+        return list(executor.map(get_llm_response, profiles))
+
 def initialize_linkedin_session():
     """Initialize LinkedIn session using StaffSpy"""
     logger.info("Initializing LinkedIn session")
     
     try:
-        # Load credentials from .env
-        load_dotenv()
-        username = os.getenv("LINKEDIN_USERNAME")
-        password = os.getenv("LINKEDIN_PASSWORD")
-        
-        if not username or not password:
+        if not LINKEDIN_USERNAME or not LINKEDIN_PASSWORD:
             raise ValueError("LinkedIn credentials not found in environment variables")
         
-        logger.info(f"Using username: {username}")
+        logger.info(f"Using username: {LINKEDIN_USERNAME}")
         
         # Initialize LinkedIn Account with minimal configuration
         try:
@@ -157,12 +201,7 @@ def initialize_linkedin_api_session(account):
     """Initialize LinkedIn API session using StaffSpy session cookies"""
     logger.info("Initializing LinkedIn API session")
     
-    # Load credentials from .env
-    load_dotenv()
-    username = os.getenv("LINKEDIN_USERNAME")
-    password = os.getenv("LINKEDIN_PASSWORD")
-    
-    if not username or not password:
+    if not LINKEDIN_USERNAME or not LINKEDIN_PASSWORD:
         raise ValueError("LinkedIn credentials not found in environment variables")
     
     # Use the RequestsCookieJar directly from StaffSpy session
@@ -171,123 +210,140 @@ def initialize_linkedin_api_session(account):
     # Initialize LinkedIn API with saved cookies
     try:
         logger.info("Initializing LinkedIn API client with saved cookies")
-        li = Linkedin(username=username, password=password, cookies=cookies, refresh_cookies=True, debug=True)
+        li = Linkedin(username=LINKEDIN_USERNAME, password=LINKEDIN_PASSWORD, cookies=cookies, refresh_cookies=True, debug=True)
         logger.info("LinkedIn API client initialized successfully")
         return li
     except Exception as e:
         logger.error(f"Failed to initialize LinkedIn API client: {str(e)}")
         raise
 
-def main():
-    try:
-        # Initialize LinkedIn session
-        account = initialize_linkedin_session()
-        
-        # Initialize LinkedIn API with the same session
-        li = initialize_linkedin_api_session(account)
-        
-        # Create scraper instance
-        logger.info("Creating LinkedIn Scraper")
-        scraper = LinkedInScraper(session=account.session)
-        
-        # 1. Scrape recent connections
-        logger.info("Scraping recent connections")
-        connections = scraper.scrape_connections(max_results=1, extra_profile_data=True)
-        
-        # Process each connection
-        for connection in connections:
-            try:
-                # Skip restricted profiles
-                if connection.name == "LinkedIn Member":
-                    continue
-                
-                # Debug log connection data
-                logger.info(f"Processing connection: {connection.name}")
-                logger.info(f"Connection URN: {connection.urn}")
-                logger.info(f"Connection data: {connection.to_dict()}")
-                
-                # Debug log raw profile data
-                logger.info("Raw profile data:")
-                logger.info(f"Experiences: {connection.experiences}")
-                logger.info(f"Skills: {connection.skills}")
-                logger.info(f"Certifications: {connection.certifications}")
-                
-                # Construct proper LinkedIn URN
-                profile_urn = connection.id
-                
-                # 2. Get detailed profile data
-                profile_data = {
-                    'name': connection.name,
-                    'current_position': connection.experiences[0].title if connection.experiences else 'N/A',
-                    'company': connection.experiences[0].company if connection.experiences else 'N/A',
-                    'skills': [skill.name for skill in connection.skills] if connection.skills else [],
-                    'experiences': [f"{exp.title} ({exp.duration})" for exp in connection.experiences] if connection.experiences else [],
-                    'certifications': [cert.title for cert in connection.certifications] if connection.certifications else []
-                }
-                
-                # Debug log processed profile data
-                logger.info("Processed profile data:")
-                logger.info(profile_data)
-                
-                # 3. Generate personalized message using LLM
-                message = get_llm_response(profile_data)
-                if not message:
-                    logger.warning(f"Skipping message for {connection.name} due to LLM error")
-                    continue
+def message_new_connections(account, li):
+    """Scrape recent connections and send each a personalized LLM-generated message"""
+    # Create scraper instance
+    logger.info("Creating LinkedIn Scraper")
+    scraper = LinkedInScraper(session=account.session)
+    
+    # 1. Scrape recent connections
+    logger.info("Scraping recent connections")
+    connections = scraper.scrape_connections(max_results=1, extra_profile_data=True)
+    
+    # Build profile data for each connection
+    to_message = []
+    for connection_index, connection in enumerate(connections):
+        try:
+            # Skip restricted profiles
+            if connection.name == "LinkedIn Member":
+                continue
+            
+            logger.info(f"Processing connection: {connection.name}")
+            logger.info(f"Connection URN: {connection.urn}")
+            
+            # Debug log full connection and raw profile data
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Connection data: %s", connection.to_dict())
+                logger.debug("Raw profile data:")
+                logger.debug("Experiences: %s", connection.experiences)
+                logger.debug("Skills: %s", connection.skills)
+                logger.debug("Certifications: %s", connection.certifications)
+            
+            # 2. Get detailed profile data
+            profile_data = {
+                'name': connection.name,
+                'current_position': connection.experiences[0].title if connection.experiences else 'N/A',
+                'company': connection.experiences[0].company if connection.experiences else 'N/A',
+                'skills': [skill.name for skill in connection.skills] if connection.skills else [],
+                'experiences': [f"{exp.title} ({exp.duration})" for exp in connection.experiences] if connection.experiences else [],
+                'certifications': [cert.title for cert in connection.certifications] if connection.certifications else []
+            }
+            
+            # Debug log processed profile data
+            logger.debug("Processed profile data: %s", profile_data)
+            
+            to_message.append((connection_index, connection, profile_data))
+            
+        except Exception as e:
+            logger.error(f"Error processing connection {connection.name}: {e}")
+            continue
+    
+    # 3. Generate personalized messages using LLM
+    messages = generate_messages([profile_data for _, _, profile_data in to_message])
+    
+    # Send each generated message
+    for (connection_index, connection, _), message in zip(to_message, messages):
+        try:
+            if not message:
+                logger.warning(f"Skipping message for {connection.name} due to LLM error")
+                continue
+            
+            # Construct proper LinkedIn URN
+            profile_urn = connection.id
+            
+            # 4. Send personalized message
+            logger.info(f"Sending message to {connection.name}")
+            logger.info(f"Using profile URN: {profile_urn}")
                 
-                # 4. Send personalized message
-                logger.info(f"Sending message to {connection.name}")
-                logger.info(f"Using profile URN: {profile_urn}")
-                    
-                retry_count = 0
-                while True:
-                    try:
-                        error = li.send_message(
-                            message_body=message,
-                            recipients=[profile_urn]
-                        )
-                        
-                        if error:
-                            logger.error(f"Failed to send message to {connection.name} - API returned error")
-                            retry_count += 1
-                        else:
-                            logger.info(f"Successfully sent message to {connection.name}")
-                            break
-                    except Exception as e:
-                        logger.error(f"Failed to send message to {connection.name} - Exception: {str(e)}")
-                        retry_count += 1
-                    
-                    # Exponential backoff with jitter
-                    base_delay = 30  # Base delay of 30 seconds
-                    max_delay = 150  # Maximum delay of 5 minutes
-                    attempt = retry_count + 1  # Current attempt number
-                    
-                    # Calculate exponential backoff with jitter
-                    delay = min(
-                        max_delay, 
-                        base_delay * (2 ** attempt) + random.uniform(0, base_delay)
+            retry_count = 0
+            max_retries = 5
+            while True:
+                try:
+                    error = li.send_message(
+                        message_body=message,
+                        recipients=[profile_urn]
                     )
                     
-                    logger.info(f"Waiting {delay:.2f} seconds before sending message (Attempt {attempt})...")
-                    time.sleep(delay)
-                    
-                # Exponential backoff with jitter before sending next message
-                base_delay = 45  # Base delay of 45 seconds
-                max_delay = 120  # Maximum delay of 2 minutes
-                connection_index = connections.index(connection)
+                    if error:
+                        logger.error(f"Failed to send message to {connection.name} - API returned error")
+                        retry_count += 1
+                    else:
+                        logger.info(f"Successfully sent message to {connection.name}")
+                        break
+                except Exception as e:
+                    logger.error(f"Failed to send message to {connection.name} - Exception: {str(e)}")
+                    retry_count += 1
+                
+                if retry_count >= max_retries:
+                    logger.error(f"Giving up on {connection.name} after {max_retries} failed attempts")
+                    break
+                
+                # Exponential backoff with jitter
+                base_delay = 30  # Base delay of 30 seconds
+                max_delay = 150  # Maximum delay of 2.5 minutes
+                attempt = min(retry_count, 5)  # Clamp the exponent
                 
                 # Calculate exponential backoff with jitter
                 delay = min(
                     max_delay, 
-                    base_delay * (2 ** connection_index) + random.uniform(0, base_delay)
+                    base_delay * (2 ** attempt) + random.uniform(0, base_delay)
                 )
                 
-                logger.info(f"Waiting {delay:.2f} seconds before sending message to next connection (Connection {connection_index + 1}/{len(connections)})...")
+                logger.info(f"Waiting {delay:.2f} seconds before sending message (Attempt {retry_count + 1})...")
                 time.sleep(delay)
                 
-            except Exception as e:
-                logger.error(f"Error processing connection {connection.name}: {e}")
-                continue
+            # Random delay before sending next message
+            delay = random.uniform(45, 90)
+            
+            logger.info(f"Waiting {delay:.2f} seconds before sending message to next connection (Connection {connection_index + 1}/{len(connections)})...")
+            time.sleep(delay)
+            
+        except Exception as e:
+            logger.error(f"Error processing connection {connection.name}: {e}")
+            continue
+
+async def message_new_connections_async(account, li):
+    """Run message_new_connections in a worker thread so it can be awaited alongside other stages"""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, message_new_connections, account, li)
+
+def main():
+    try:
+        # Initialize LinkedIn session
+        account = initialize_linkedin_session()
+        
+        # Initialize LinkedIn API with the same session
+        li = initialize_linkedin_api_session(account)
+        
+        # Scrape recent connections and message them
+        message_new_connections(account, li)
             
     except Exception as e:
         logger.error(f"Pipeline error: {e}")
@@ -1,17 +1,19 @@
 from linkedin_api import Linkedin
-import json
+import asyncio
+import orjson
 import logging
 import os
 import csv
-import pandas as pd
-from datetime import datetime
 import re
 from dotenv import load_dotenv
 from staffspy.linkedin.linkedin import LinkedInScraper
 from staffspy import LinkedInAccount, DriverType, BrowserType
 import time
 import random
-from requests.cookies import RequestsCookieJar
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from requests.cookies import RequestsCookieJar, create_cookie
+from urllib3.util.retry import Retry
 
 # Set up logging with more detailed format
 logging.basicConfig(
@@ -21,73 +23,108 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Load credentials from .env once at startup
+load_dotenv()
+LINKEDIN_USERNAME = os.getenv("LINKEDIN_USERNAME")
+LINKEDIN_PASSWORD = os.getenv("LINKEDIN_PASSWORD")
+
+# Only one response is sent per conversation, so stop scanning its messages
+# once the first message with contact details has been found
+STOP_AFTER_FIRST_CONTACT_MSG = True
+
+# Response messages are sent concurrently once all conversations are processed;
+# keep the number in flight small to stay well under LinkedIn's rate limits
+RESPONSE_CONCURRENCY = 8
+RESPONSE_MAX_RETRIES = 3
+
+# Column order for the CSV outputs
+CONVERSATION_FIELDS = ['conversation_id', 'total_events', 'unread_count', 'last_activity', 'is_group_chat', 'inbox_type', 'read_status']
+PARTICIPANT_FIELDS = ['participant_id', 'first_name', 'last_name', 'occupation', 'public_id', 'profile_urn']
+CONTACT_DETAIL_FIELDS = ['conversation_id', 'message_id', 'timestamp', 'phone_numbers', 'emails']
+
+# Email and phone patterns combined so each message is scanned once:
+# email addresses or Indian phone numbers (10 digits, may start with +91, 91 or 0).
+# Emails are tried first so an address whose local part starts with a phone number
+# (9876543210@gmail.com) is kept as an email rather than cut down to the phone.
+# The prefix sits outside the phone group so matches come back already cleaned.
+# The lookarounds keep phones from matching inside longer digit runs and only let an
+# email start at the beginning of its local part, so long junk runs are scanned once
+CONTACT_RE = re.compile(
+    r'(?<![a-zA-Z0-9._%+-])(?P<email>[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})'
+    r'|(?<![\d+])(?:\+?91|0)?(?P<phone>[6789]\d{9})(?!\d)'
+)
+
 def extract_urn_id(participant_id):
-    logger.debug(f"Extracting URN ID from: {participant_id}")
+    logger.debug("Extracting URN ID from: %s", participant_id)
     if not participant_id:
         logger.warning("Received empty participant_id")
         return None
-    urn_id = participant_id.split(':')[-1]
-    logger.debug(f"Extracted URN ID: {urn_id}")
+    urn_id = participant_id.rpartition(':')[2]
+    logger.debug("Extracted URN ID: %s", urn_id)
     return urn_id
 
 def extract_contact_details(message_text):
     """Extract phone numbers and email addresses from message text"""
-    logger.debug(f"Starting contact detail extraction from message: {message_text[:50]}...")
-    
-    # Indian phone number pattern (10 digits, may start with +91 or 0)
-    phone_pattern = r'(?:(?:\+91|0)?[6789]\d{9})'
-    # Email pattern
-    email_pattern = r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}'
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Starting contact detail extraction from message: %s...", message_text[:50])
     
     contact_info = {
         'phone_numbers': [],
         'emails': []
     }
     
-    # Find all matches
-    phone_numbers = re.findall(phone_pattern, message_text)
-    emails = re.findall(email_pattern, message_text)
-    
-    logger.debug(f"Found {len(phone_numbers)} phone numbers and {len(emails)} email addresses")
+    # Find all matches in a single pass
+    cleaned_numbers = []
+    emails = []
+    for match in CONTACT_RE.finditer(message_text):
+        if match.lastgroup == 'phone':
+            cleaned_numbers.append(match.group('phone'))
+        else:
+            emails.append(match.group('email'))
     
-    # Clean phone numbers (remove +91 or leading 0)
-    cleaned_numbers = [re.sub(r'^(?:\+91|0)', '', num) for num in phone_numbers]
+    logger.debug("Found %d phone numbers and %d email addresses", len(cleaned_numbers), len(emails))
     
     if cleaned_numbers:
         contact_info['phone_numbers'] = cleaned_numbers
-        logger.info(f"Phone number(s) fetched successfully. Numbers found: {', '.join(cleaned_numbers)}")
+        logger.info("Phone number(s) fetched successfully. Numbers found: %s", ', '.join(cleaned_numbers))
     
     if emails:
         contact_info['emails'] = emails
-        logger.info(f"Email ID(s) fetched successfully. Emails found: {', '.join(emails)}")
+        logger.info("Email ID(s) fetched successfully. Emails found: %s", ', '.join(emails))
     
     return contact_info
 
 def save_raw_json(data, filename, output_dir):
-    logger.debug(f"Attempting to save raw data to file: {filename}")
+    logger.debug("Attempting to save raw data to file: %s", filename)
     filepath = os.path.join(output_dir, filename)
     try:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2)
+        with open(filepath, 'wb') as f:
+            # Compact output: indenting a large mailbox dump costs time and disk for no benefit
+            f.write(orjson.dumps(data))
         logger.info(f"Successfully saved raw data to {filepath}")
     except Exception as e:
         logger.error(f"Error saving raw data to {filepath}: {str(e)}")
         raise
 
+def format_timestamp(ms):
+    """Format a LinkedIn millisecond timestamp as local 'YYYY-MM-DD HH:MM:SS'"""
+    t = time.localtime(ms / 1000)
+    return "%04d-%02d-%02d %02d:%02d:%02d" % (t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec)
+
 def extract_conversation_data(conversation):
-    logger.debug(f"Extracting data from conversation: {conversation.get('entityUrn', 'No URN')}")
+    logger.debug("Extracting data from conversation: %s", conversation.get('entityUrn', 'No URN'))
     
     conversation_data = {
         'conversation_id': conversation.get('entityUrn', ''),
         'total_events': conversation.get('totalEventCount', 0),
         'unread_count': conversation.get('unreadCount', 0),
-        'last_activity': datetime.fromtimestamp(conversation.get('lastActivityAt', 0)/1000).strftime('%Y-%m-%d %H:%M:%S'),
+        'last_activity': format_timestamp(conversation.get('lastActivityAt', 0)),
         'is_group_chat': conversation.get('groupChat', False),
         'inbox_type': conversation.get('inboxType', ''),
         'read_status': conversation.get('read', False)
     }
     
-    logger.debug(f"Extracted conversation data: {conversation_data}")
+    logger.debug("Extracted conversation data: %s", conversation_data)
     return conversation_data
 
 def extract_participant_data(participant):
@@ -105,16 +142,18 @@ def extract_participant_data(participant):
         'profile_urn': profile.get('entityUrn', '')
     }
     
-    logger.debug(f"Extracted participant data for: {participant_info['first_name']} {participant_info['last_name']}")
+    logger.debug("Extracted participant data for: %s %s", participant_info['first_name'], participant_info['last_name'])
     return participant_info
 
 def extract_message_data(events):
-    """Extract message data from conversation events"""
-    logger.debug(f"Starting message extraction from {len(events)} events")
-    messages = []
+    """Yield message data from conversation events.
+    
+    Messages are produced lazily so callers that stop early never build the rest.
+    """
+    logger.debug("Starting message extraction from %d events", len(events))
     
     for idx, event in enumerate(events, 1):
-        logger.debug(f"Processing event {idx}/{len(events)}")
+        logger.debug("Processing event %d/%d", idx, len(events))
         
         if 'eventContent' in event:
             content = event.get('eventContent', {})
@@ -123,54 +162,136 @@ def extract_message_data(events):
             if message_event:
                 message = {
                     'message_id': event.get('entityUrn', ''),
-                    'created_at': datetime.fromtimestamp(event.get('createdAt', 0)/1000).strftime('%Y-%m-%d %H:%M:%S'),
+                    'created_at': format_timestamp(event.get('createdAt', 0)),
                     'text': message_event.get('attributedBody', {}).get('text', '')
                 }
-                logger.debug(f"Extracted message: ID={message['message_id']}, Created={message['created_at']}")
-                messages.append(message)
+                logger.debug("Extracted message: ID=%s, Created=%s", message['message_id'], message['created_at'])
+                yield message
             else:
                 logger.debug("Event does not contain message data")
-    
-    logger.info(f"Extracted {len(messages)} messages from events")
-    return messages
 
 def send_response_message(api, conversation_urn):
-    """Send a response message to a conversation"""
-    logger.debug(f"Attempting to send response message to conversation: {conversation_urn}")
+    """Send a response message to a conversation.
+    
+    Returns True if the message was sent, False if LinkedIn rejected it (safe to retry),
+    or None if an exception left it unknown whether the message went out.
+    """
+    logger.debug("Attempting to send response message to conversation: %s", conversation_urn)
     
     try:
         # Extract conversation ID from URN
-        conversation_id = conversation_urn.split(':')[-1]
-        logger.debug(f"Extracted conversation ID: {conversation_id}")
+        conversation_id = conversation_urn.rpartition(':')[2]
+        logger.debug("Extracted conversation ID: %s", conversation_id)
         
         # Standard response message
         response_message = "Thank you for showing an interest in us. A career counseling expert will be contacting you shortly!"
         
-        # Send the message
-        api.send_message(
+        # Send the message; the API returns True if the request failed
+        error = api.send_message(
             message_body=response_message,
             conversation_urn_id=conversation_id
         )
-        logger.info(f"Successfully sent response message to conversation {conversation_id}")
+        if error:
+            logger.error(f"Failed to send response message to {conversation_urn} - API returned error")
+            return False
+        
+        logger.info("Successfully sent response message to conversation %s", conversation_id)
         return True
     except Exception as e:
         logger.error(f"Error sending response message to {conversation_urn}: {str(e)}")
-        return False
+        return None
+
+async def send_response_messages_async(api, conversation_urns):
+    """Send response messages to several conversations, RESPONSE_CONCURRENCY at a time"""
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(RESPONSE_CONCURRENCY)
+    
+    async def send(executor, conversation_urn):
+        async with semaphore:
+            for attempt in range(1, RESPONSE_MAX_RETRIES + 1):
+                sent = await loop.run_in_executor(executor, send_response_message, api, conversation_urn)
+                if sent:
+                    return True
+                if sent is None:
+                    # The message may already have been delivered, so retrying could post it twice
+                    logger.error(f"Not retrying response to {conversation_urn} after an exception")
+                    return False
+                if attempt == RESPONSE_MAX_RETRIES:
+                    break
+                
+                # Exponential backoff with jitter before retrying
+                delay = 2 ** attempt + random.uniform(0, 1)
+                logger.info("Retrying response to %s in %.2f seconds (Attempt %d)", conversation_urn, delay, attempt + 1)
+                await asyncio.sleep(delay)
+            
+            logger.error(f"Giving up on response to {conversation_urn} after {RESPONSE_MAX_RETRIES} failed attempts")
+            return False
+    
+    # The LinkedIn client is blocking, so each send runs on a worker thread
+    with ThreadPoolExecutor(max_workers=RESPONSE_CONCURRENCY) as executor:
+        results = await asyncio.gather(*(send(executor, urn) for urn in conversation_urns))
+    return sum(results)
+
+def process_conversation(conv):
+    """Extract conversation info, contact details and participants from one conversation.
+    
+    Returns (conv_info, contacts, participants, response_urn), where response_urn is
+    the conversation URN if a response should be sent, otherwise None.
+    """
+    conv_info = extract_conversation_data(conv)
+    contacts = []
+    response_urn = None
+    
+    # Only process messages if there are unread messages
+    if conv_info['unread_count'] > 0:
+        logger.info("Found %d unread messages in conversation %s", conv_info['unread_count'], conv_info['conversation_id'])
+        
+        events = conv.get('events', [])
+        logger.debug("Found %d events in conversation", len(events))
+        
+        # Extract messages from events and check each for contact details
+        for msg_idx, message in enumerate(extract_message_data(events), 1):
+            logger.debug("Processing message %d", msg_idx)
+            contact_details = extract_contact_details(message['text'])
+            
+            if contact_details['phone_numbers'] or contact_details['emails']:
+                contact_data = {
+                    'conversation_id': conv_info['conversation_id'],
+                    'message_id': message['message_id'],
+                    'timestamp': message['created_at'],
+                    'phone_numbers': contact_details['phone_numbers'],
+                    'emails': contact_details['emails']
+                }
+                logger.info("Found contact details in message: %s", contact_data)
+                contacts.append(contact_data)
+                
+                if STOP_AFTER_FIRST_CONTACT_MSG:
+                    break
+        
+        if contacts:
+            logger.info("Contact details found, queueing response message")
+            response_urn = conv_info['conversation_id']
+    
+    # Process participants
+    participants = conv.get('participants', [])
+    logger.info("Processing %d participants in conversation", len(participants))
+    
+    participant_infos = []
+    for part_idx, participant in enumerate(participants, 1):
+        logger.debug("Processing participant %d/%d", part_idx, len(participants))
+        participant_infos.append(extract_participant_data(participant))
+    
+    return conv_info, contacts, participant_infos, response_urn
 
 def initialize_linkedin_session():
     """Initialize LinkedIn session using StaffSpy"""
     logger.info("Initializing LinkedIn session")
     
     try:
-        # Load credentials from .env
-        load_dotenv()
-        username = os.getenv("LINKEDIN_USERNAME")
-        password = os.getenv("LINKEDIN_PASSWORD")
-        
-        if not username or not password:
+        if not LINKEDIN_USERNAME or not LINKEDIN_PASSWORD:
             raise ValueError("LinkedIn credentials not found in environment variables")
         
-        logger.info(f"Using username: {username}")
+        logger.info(f"Using username: {LINKEDIN_USERNAME}")
         
         # Initialize LinkedIn Account with minimal configuration
         try:
@@ -208,20 +329,29 @@ def initialize_linkedin_api_session(account):
         # Get cookies from StaffSpy session
         cookie_dict = account.session.cookies.get_dict()
         
-        # Convert dict to RequestsCookieJar
+        # Convert dict to RequestsCookieJar, adding the cookies directly
+        # rather than going through the per-call lookup in jar.set()
         cookies = RequestsCookieJar()
         for name, value in cookie_dict.items():
-            cookies.set(name, value, domain='.linkedin.com')
+            cookies.set_cookie(create_cookie(name, value, domain='.linkedin.com'))
         
         # Initialize LinkedIn API with cookies
         api = Linkedin(
-            username=os.getenv("LINKEDIN_USERNAME"),
-            password=os.getenv("LINKEDIN_PASSWORD"),
+            username=LINKEDIN_USERNAME,
+            password=LINKEDIN_PASSWORD,
             cookies=cookies,
             refresh_cookies=False,
             debug=True
         )
         
+        # Size the connection pool for concurrent response sends so they reuse
+        # keep-alive connections; POSTs are not retried, to avoid duplicate messages
+        api.client.session.mount('https://', HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=16,
+            max_retries=Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
+        ))
+        
         logger.info("LinkedIn API session initialized successfully")
         return api
         
@@ -252,90 +382,72 @@ def main():
         # Save raw conversations response
         save_raw_json(conversations, 'raw_conversations.json', output_dir)
         
-        # Process conversations and participants
-        conversation_data = []
-        participant_data = []
-        contact_details_data = []
+        # Participant details go to a single JSONL file
+        participants_jsonl_fh = open(os.path.join(output_dir, 'participants.jsonl'), 'wb', buffering=1 << 20)
         
-        elements = conversations.get('elements', [])
-        logger.info(f"Processing {len(elements)} conversations")
-        
-        for idx, conv in enumerate(elements, 1):
-            logger.info(f"Processing conversation {idx}/{len(elements)}")
-            
-            conv_info = extract_conversation_data(conv)
-            conversation_data.append(conv_info)
-            
-            # Only process messages if there are unread messages
-            if conv_info['unread_count'] > 0:
-                logger.info(f"Found {conv_info['unread_count']} unread messages in conversation {conv_info['conversation_id']}")
-                
-                # Extract messages from events
-                events = conv.get('events', [])
-                logger.debug(f"Found {len(events)} events in conversation")
-                messages = extract_message_data(events)
+        # Process conversations and participants, writing CSV rows as they are produced
+        logger.info("Writing processed data to CSV files...")
+        try:
+            with open(os.path.join(output_dir, 'conversations.csv'), 'w', newline='', encoding='utf-8', buffering=1 << 20) as conversations_fh, \
+                    open(os.path.join(output_dir, 'participants.csv'), 'w', newline='', encoding='utf-8', buffering=1 << 20) as participants_fh, \
+                    open(os.path.join(output_dir, 'contact_details.csv'), 'w', newline='', encoding='utf-8', buffering=1 << 20) as contact_details_fh:
+                conversations_writer = csv.DictWriter(conversations_fh, fieldnames=CONVERSATION_FIELDS)
+                participants_writer = csv.DictWriter(participants_fh, fieldnames=PARTICIPANT_FIELDS)
+                contact_details_writer = csv.DictWriter(contact_details_fh, fieldnames=CONTACT_DETAIL_FIELDS)
+                conversations_writer.writeheader()
+                participants_writer.writeheader()
+                contact_details_writer.writeheader()
+                contact_details_count = 0
+                urns_to_respond = []
+                # Participants show up in many conversations; record each one only once
+                seen_urns = set()
                 
-                # Process each message for contact details
-                logger.debug(f"Processing {len(messages)} messages for contact details")
-                contact_found = False
+                elements = conversations.get('elements', [])
+                logger.info(f"Processing {len(elements)} conversations")
                 
-                for msg_idx, message in enumerate(messages, 1):
-                    logger.debug(f"Processing message {msg_idx}/{len(messages)}")
-                    contact_details = extract_contact_details(message['text'])
+                # Extraction is pure-Python work that holds the GIL, so it runs inline;
+                # each result is written as soon as it is produced
+                results = map(process_conversation, elements)
+                for idx, (conv_info, contacts, participants, response_urn) in enumerate(results, 1):
+                    logger.info("Processed conversation %d/%d", idx, len(elements))
+                    conversations_writer.writerow(conv_info)
                     
-                    if contact_details['phone_numbers'] or contact_details['emails']:
-                        contact_found = True
-                        contact_data = {
-                            'conversation_id': conv_info['conversation_id'],
-                            'message_id': message['message_id'],
-                            'timestamp': message['created_at'],
-                            'phone_numbers': contact_details['phone_numbers'],
-                            'emails': contact_details['emails']
-                        }
-                        logger.info(f"Found contact details in message: {contact_data}")
-                        contact_details_data.append(contact_data)
-                
-                # Send response message if contact details were found
-                if contact_found:
-                    logger.info("Contact details found, sending response message...")
-                    conversation_urn = conv_info['conversation_id']
-                    send_response_message(api, conversation_urn)
-            
-            # Process participants
-            participants = conv.get('participants', [])
-            logger.info(f"Processing {len(participants)} participants in conversation")
-            
-            for part_idx, participant in enumerate(participants, 1):
-                logger.debug(f"Processing participant {part_idx}/{len(participants)}")
-                participant_info = extract_participant_data(participant)
-                participant_data.append(participant_info)
-                
-                # Save individual participant details
-                urn_id = extract_urn_id(participant_info['participant_id'])
-                if urn_id:
-                    save_raw_json(participant_info, f'participant_details_{urn_id}.json', output_dir)
-        
-        # Save processed data to CSV files
-        logger.info("Saving processed data to CSV files...")
-        
-        # Save conversations data
-        conversations_df = pd.DataFrame(conversation_data)
-        conversations_df.to_csv(os.path.join(output_dir, 'conversations.csv'), index=False)
-        logger.info("Saved conversations data to CSV")
-        
-        # Save participants data
-        participants_df = pd.DataFrame(participant_data)
-        participants_df.to_csv(os.path.join(output_dir, 'participants.csv'), index=False)
-        logger.info("Saved participants data to CSV")
+                    contact_details_writer.writerows({
+                        **contact_data,
+                        'phone_numbers': ';'.join(contact_data['phone_numbers']),
+                        'emails': ';'.join(contact_data['emails'])
+                    } for contact_data in contacts)
+                    contact_details_count += len(contacts)
+                    
+                    # Queue a response message if contact details were found
+                    if response_urn:
+                        urns_to_respond.append(response_urn)
+                    
+                    for participant_info in participants:
+                        urn_id = extract_urn_id(participant_info['participant_id'])
+                        if urn_id in seen_urns:
+                            continue
+                        participants_writer.writerow(participant_info)
+                        
+                        # Append participant details to the JSONL file
+                        if urn_id:
+                            seen_urns.add(urn_id)
+                            participants_jsonl_fh.write(orjson.dumps(participant_info) + b'\n')
+        finally:
+            participants_jsonl_fh.close()
         
-        # Save contact details data
-        if contact_details_data:
-            contact_details_df = pd.DataFrame(contact_details_data)
-            contact_details_df.to_csv(os.path.join(output_dir, 'contact_details.csv'), index=False)
-            logger.info("Saved contact details to CSV")
+        logger.info("Saved conversations and participants data to CSV")
+        if contact_details_count:
+            logger.info(f"Saved {contact_details_count} contact details to CSV")
         else:
             logger.info("No contact details found to save")
         
+        # Send the queued response messages concurrently
+        if urns_to_respond:
+            logger.info(f"Sending response messages to {len(urns_to_respond)} conversations...")
+            sent_count = asyncio.run(send_response_messages_async(api, urns_to_respond))
+            logger.info(f"Sent {sent_count}/{len(urns_to_respond)} response messages")
+        
         logger.info("LinkedIn message processing pipeline completed successfully")
         
     except Exception as e:
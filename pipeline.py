@@ -0,0 +1,65 @@
+"""
+Combined LinkedIn AI Lead Generation Agent
+
+Runs Pipeline 1 (scrape profiles and send connection requests) and
+Pipeline 2 (message new connections) as stages of a single process, so
+both share one LinkedIn session instead of each doing its own
+Firefox-driven login.
+
+StaffSpy persists the logged-in session to Pipeline 1's session file, so
+restarting this process reuses the saved cookies and skips the browser.
+
+"""
+
+import asyncio
+import logging
+from logging.handlers import RotatingFileHandler
+
+from pipe_1_final_jan17 import (
+    logger,
+    log_filename,
+    file_handler,
+    initialize_linkedin_session,
+    initialize_linkedin_api_session,
+    scrape_and_connect_async
+)
+from pipe_2_final_jan17 import message_new_connections_async
+
+# Pipeline 1's logger has its own handlers; don't repeat its records through
+# the root handlers Pipeline 2 configures on import
+logging.getLogger('main').propagate = False
+
+# Both pipes log to logs/linkedin_pipeline_<timestamp>.log, so importing them in
+# the same second points two handlers at one file. Route Pipeline 2's records to
+# Pipeline 1's file handler instead of keeping its own rotating handler
+root_logger = logging.getLogger()
+for handler in root_logger.handlers[:]:
+    if isinstance(handler, RotatingFileHandler):
+        root_logger.removeHandler(handler)
+        handler.close()
+root_logger.addHandler(file_handler)
+
+async def run():
+    """Initialize the LinkedIn session once, then run both pipeline stages"""
+    account = initialize_linkedin_session()
+    api_client = initialize_linkedin_api_session(account)
+    
+    # Stage 1: scrape profiles and send connection requests
+    await scrape_and_connect_async(account, api_client)
+    
+    # Stage 2: message recently accepted connections
+    await message_new_connections_async(account, api_client)
+
+def main():
+    """Main entry point"""
+    try:
+        logger.info("Starting combined LinkedIn pipeline")
+        logger.info(f"Logging to file: {log_filename}")
+        asyncio.run(run())
+        
+    except Exception as e:
+        logger.critical(f"Critical error in pipeline execution: {str(e)}")
+        raise
+
+if __name__ == "__main__":
+    main()